@@ -2,6 +2,7 @@
 # vim: set et ts=8 sts=4 sw=4 ai:
 
 import re
+import functools
 import yaml
 
 from mistune.inline_parser import LINK_LABEL
@@ -10,6 +11,39 @@ import urllib.parse
 
 __all__ = ['plugin_task_lists', 'plugin_footnotes']
 
+_ALPHA = 'abcdefghijklmnopqrstuvwxyz'
+
+
+@functools.lru_cache(maxsize=16)
+def _indent_strip_re(spaces):
+    """
+    Compiled pattern matching an indentation of at least `spaces` blanks.
+    """
+    return re.compile(r'^ {%d,}' % spaces, flags=re.M)
+
+
+def _unwrap_paragraph(text):
+    """
+    Remove the leading <p> and the trailing </p> from a rendered block.
+    """
+    return text.removeprefix('<p>').removesuffix('</p>')
+
+
+def _insert_rule(rules, name, before=None, after=None):
+    """
+    Insert the rule `name` before or after an existing rule, append it
+    when the existing rule can not be found.
+    """
+    try:
+        if before is not None:
+            index = rules.index(before)
+        else:
+            index = rules.index(after) + 1
+    except ValueError:
+        rules.append(name)
+    else:
+        rules.insert(index, name)
+
 
 class mistunePluginFootnotes:
     """
@@ -45,20 +79,11 @@ class mistunePluginFootnotes:
         """
         1->a, 2->b, 26->z, 27->aa, 28->ab, 54->bb
         """
-
-        num2alphadict = dict(zip(range(1, 27), 'abcdefghijklmnopqrstuvwxyz'))
-        outval = ""
-        numloops = (num - 1) // 26
-
-        if numloops > 0:
-            outval = outval + self._letter_from_index(numloops)
-
-        remainder = num % 26
-        if remainder > 0:
-            outval = outval + num2alphadict[remainder]
-        else:
-            outval = outval + "z"
-        return outval
+        outval = []
+        while num > 0:
+            num, remainder = divmod(num - 1, 26)
+            outval.append(_ALPHA[remainder])
+        return "".join(reversed(outval))
 
     def parse_inline_footnote(self, inline, m, state):
         key = unikey(m.group(1))
@@ -70,31 +95,38 @@ class mistunePluginFootnotes:
         index += 1
         state['footnote_index'] = index
         state['footnotes'].append(key)
+        state['_has_footnotes'] = True
         # footnote number
-        fn = list(state['def_footnotes'].keys()).index(key) + 1
+        fn = state['def_footnote_order'][key]
         return 'footnote_ref', key, fn, index
 
     def parse_def_footnote(self, block, m, state):
         key = unikey(m.group(2))
         if key not in state['def_footnotes']:
             state['def_footnotes'][key] = m.group(3)
+            # remember the position of the footnote, so that references
+            # don't have to search the list of keys
+            order = state.setdefault('def_footnote_order', {})
+            order[key] = len(order) + 1
 
     def parse_footnote_item(self, block, k, refs, state):
         def_footnotes = state['def_footnotes']
         text = def_footnotes[k]
-        idx = list(def_footnotes.keys()).index(k) + 1
+        idx = state['def_footnote_order'][k]
         stripped_text = text.strip()
         if '\n' not in stripped_text:
             children = [{'type': 'paragraph', 'text': stripped_text}]
         else:
-            lines = text.splitlines()
+            # find the first non-empty line after the first one
+            lines = iter(text.splitlines())
+            next(lines, "")
             second_line = ""
-            for second_line in lines[1:]:
-                if second_line:
+            for line in lines:
+                if line:
+                    second_line = line
                     break
             spaces = len(second_line) - len(second_line.lstrip())
-            pattern = re.compile(r'^ {' + str(spaces) + r',}', flags=re.M)
-            text = pattern.sub('', text)
+            text = _indent_strip_re(spaces).sub('', text)
             children = block.parse_text(text, state)
             if not isinstance(children, list):
                 children = [children]
@@ -106,13 +138,18 @@ class mistunePluginFootnotes:
         }
 
     def md_footnotes_hook(self, md, result, state):
-        footnotes = state.get('footnotes')
-        if not footnotes:
+        # only set once a defined footnote has been referenced
+        if not state.get('_has_footnotes'):
             return result
 
+        # collect the references of every footnote in a single pass
+        ref_map = {}
+        for i, k in enumerate(state['footnotes']):
+            ref_map.setdefault(k, []).append(i + 1)
+
         children = []
-        for k in state.get('def_footnotes'):
-            refs = [i + 1 for i, j in enumerate(footnotes) if j == k]
+        for k in state['def_footnotes']:
+            refs = ref_map.get(k, [])
             children.append(self.parse_footnote_item(md.block, k, refs, state))
 
         tokens = [{'type': 'footnotes', 'children': children}]
@@ -149,11 +186,7 @@ class mistunePluginFootnotes:
                 + ' '
             )
 
-        text = text.rstrip()
-        if text.startswith('<p>'):
-            text = text[3:]
-        if text.endswith('</p>'):
-            text = text[:-4]
+        text = _unwrap_paragraph(text.rstrip())
         text = back + text
         return '<li id="fn-' + str(kindex) + '">' + text + '</li>\n'
 
@@ -163,20 +196,12 @@ class mistunePluginFootnotes:
             self.INLINE_FOOTNOTE_PATTERN,
             self.parse_inline_footnote,
         )
-        index = md.inline.rules.index('std_link')
-        if index != -1:
-            md.inline.rules.insert(index, 'footnote')
-        else:
-            md.inline.rules.append('footnote')
+        _insert_rule(md.inline.rules, 'footnote', before='std_link')
 
         md.block.register_rule(
             'def_footnote', self.DEF_FOOTNOTE, self.parse_def_footnote
         )
-        index = md.block.rules.index('def_link')
-        if index != -1:
-            md.block.rules.insert(index, 'def_footnote')
-        else:
-            md.block.rules.append('def_footnote')
+        _insert_rule(md.block.rules, 'def_footnote', before='def_link')
 
         if md.renderer.NAME == 'html':
             md.renderer.register('footnote_ref', self.render_html_footnote_ref)
@@ -194,8 +219,19 @@ class mistunePluginTaskLists:
     """
 
     TASK_LIST_ITEM = re.compile(r'^(\[[ xX]\])\s+')
+    TASK_LIST_MARKS = ('[ ]', '[x]', '[X]')
+
+    def before_parse(self, md, s, state):
+        # a cheap check if the document contains any checkbox at all,
+        # if not, walking the tokens in task_lists_hook can be skipped
+        state['_has_task_lists'] = any(
+            mark in s for mark in self.TASK_LIST_MARKS
+        )
+        return s, state
 
     def task_lists_hook(self, md, tokens, state):
+        if not state.get('_has_task_lists', True):
+            return tokens
         return self._rewrite_all_list_items(tokens)
 
     def render_ast_task_list_item(self, children, level, checked):
@@ -214,13 +250,14 @@ class mistunePluginTaskLists:
             checkbox += '/>'
 
         if text.startswith('<p>'):
-            text = text.replace('<p>', '<p>' + checkbox, 1)
+            text = '<p>' + checkbox + text[3:]
         else:
             text = checkbox + text
 
         return '<li class="task-list-item">' + text + '</li>\n'
 
     def __call__(self, md):
+        md.before_parse_hooks.append(self.before_parse)
         md.before_render_hooks.append(self.task_lists_hook)
 
         if md.renderer.NAME == 'html':
@@ -233,11 +270,15 @@ class mistunePluginTaskLists:
             )
 
     def _rewrite_all_list_items(self, tokens):
-        for tok in tokens:
-            if tok['type'] == 'list_item':
-                self._rewrite_list_item(tok)
-            if 'children' in tok.keys():
-                self._rewrite_all_list_items(tok['children'])
+        # walk the token tree with an explicit stack instead of recursion
+        stack = [tokens]
+        while stack:
+            for tok in stack.pop():
+                if tok['type'] == 'list_item':
+                    self._rewrite_list_item(tok)
+                children = tok.get('children')
+                if children:
+                    stack.append(children)
         return tokens
 
     def _rewrite_list_item(self, item):
@@ -276,11 +317,7 @@ class mistunePluginMark:
     def __call__(self, md):
         md.inline.register_rule('mark', self.MARK_PATTERN, self.parse_mark)
 
-        index = md.inline.rules.index('codespan')
-        if index != -1:
-            md.inline.rules.insert(index + 1, 'mark')
-        else:  # pragma: no cover
-            md.inline.rules.append('mark')
+        _insert_rule(md.inline.rules, 'mark', after='codespan')
 
         if md.renderer.NAME == 'html':
             md.renderer.register('mark', self.render_html_mark)
@@ -292,28 +329,50 @@ class mistunePluginFancyBlocks:
     :::
     """
 
+    #: the body is matched as whole lines with a greedy [^\n]* each, instead
+    #: of a lazy [\s\S]*? that advances one character per step. Both forms
+    #: give the same groups and match ends; this one is faster on longer
+    #: lines (and marginally slower on very short ones).
     FANCY_BLOCK = re.compile(
         r'( {0,3})(\:{3,}|~{3,})([^\:\n]*)\n'
-        r'(?:|([\s\S]*?)\n)'
+        r'(?:|((?:[^\n]*\n)*?[^\n]*)\n)'
         r'(?: {0,3}\2[~\:]* *\n+|$)'
     )
     FANCY_BLOCK_HEADER = re.compile(r'^#{1,5}\s*(.*)\n+')
+    FAMILY_CLASSES = {
+        "info": "alert alert-primary",
+        "blue": "alert alert-primary",
+        "warning": "alert alert-secondary",
+        "yellow": "alert alert-secondary",
+        "danger": "alert alert-danger",
+        "red": "alert alert-danger",
+        "success": "alert alert-success",
+        "green": "alert alert-success",
+        "none": "alert",
+        "empty": "alert",
+    }
 
     def parse_fancy_block(self, block, m, state):
         text = m.group(4) or ""
         family = m.group(3).strip().lower()
 
         # find (and remove) the header from the text block
-        header = self.FANCY_BLOCK_HEADER.match(text)
-        if header is not None:
-            header = header.group(1)
-            text = self.FANCY_BLOCK_HEADER.sub('', text, 1)
+        header = None
+        header_match = self.FANCY_BLOCK_HEADER.match(text)
+        if header_match is not None:
+            header = header_match.group(1)
+            text = text[header_match.end() :]
 
         # parse the text inside the block, remove headings from the rules
         # -- we dont wont them in the toc so these are handled extra
-        rules = list(block.rules)
-        rules.remove('axt_heading')
-        rules.remove('setex_heading')
+        src, rules = self._reduced_rules
+        if src is not block.rules:
+            rules = tuple(
+                r
+                for r in block.rules
+                if r not in ('axt_heading', 'setex_heading')
+            )
+            self._reduced_rules = (block.rules, rules)
 
         # add a trailing newline, so that the childen get rendered correctly
         if len(text) < 1 or text[-1] != "\n":
@@ -331,18 +390,7 @@ class mistunePluginFancyBlocks:
         }
 
     def render_html_fancy_block(self, text, family, header):
-        if family in ["info", "blue"]:
-            cls = "alert alert-primary"
-        elif family in ["warning", "yellow"]:
-            cls = "alert alert-secondary"
-        elif family in ["danger", "red"]:
-            cls = "alert alert-danger"
-        elif family in ["success", "green"]:
-            cls = "alert alert-success"
-        elif family in ["none", "empty"]:
-            cls = "alert"
-        else:
-            cls = "alert"
+        cls = self.FAMILY_CLASSES.get(family, "alert")
         if header is not None:
             header = f'<h4 class="alert-heading">{header}</h4>'
         else:
@@ -353,6 +401,10 @@ class mistunePluginFancyBlocks:
         )
 
     def __call__(self, md):
+        # (block.rules, block.rules without the headings), filled in
+        # by the first parsed block
+        self._reduced_rules = (None, None)
+
         md.block.register_rule(
             'fancy_block', self.FANCY_BLOCK, self.parse_fancy_block
         )
@@ -385,11 +437,7 @@ class mistunePluginSpoiler:
         }
 
     def render_html_spoiler_block(self, text):
-        text = text.strip()
-        if text.startswith('<p>'):
-            text = text[3:]
-        if text.endswith('</p>'):
-            text = text[:-4]
+        text = _unwrap_paragraph(text.strip())
         return f'<div class="spoiler">\n  <button class="spoiler-button" onclick="otterwiki.toggle_spoiler(this)"><i class="far fa-eye"></i></button>\n  <p>{text}</p>\n</div>\n\n'
 
     def __call__(self, md):
@@ -397,11 +445,7 @@ class mistunePluginSpoiler:
             'spoiler_block', self.SPOILER_BLOCK, self.parse_spoiler_block
         )
 
-        index = md.block.rules.index('block_quote')
-        if index != -1:
-            md.block.rules.insert(index, 'spoiler_block')
-        else:
-            md.block.rules.append('spoiler_block')
+        _insert_rule(md.block.rules, 'spoiler_block', before='block_quote')
 
         if md.renderer.NAME == "html":
             md.renderer.register(
@@ -423,10 +467,11 @@ class mistunePluginFold:
         text = self.FOLD_LEADING.sub('', text).strip()
 
         # find (and remove) the header from the text block
-        header = self.FOLD_BLOCK_HEADER.match(text)
-        if header is not None:
-            header = header.group(1)
-            text = self.FOLD_BLOCK_HEADER.sub('', text, 1)
+        header = None
+        header_match = self.FOLD_BLOCK_HEADER.match(text)
+        if header_match is not None:
+            header = header_match.group(1)
+            text = text[header_match.end() :]
 
         # add a trailing newline, so that the childen get rendered correctly
         if len(text) < 1 or text[-1] != "\n":
@@ -444,11 +489,7 @@ class mistunePluginFold:
         }
 
     def render_html_fold_block(self, text, header=None):
-        text = text.strip()
-        if text.startswith('<p>'):
-            text = text[3:]
-        if text.endswith('</p>'):
-            text = text[:-4]
+        text = _unwrap_paragraph(text.strip())
         if header is None:
             header = "..."
         return f'''<details class="collapse-panel">
@@ -462,18 +503,16 @@ class mistunePluginFold:
             'fold_block', self.FOLD_BLOCK, self.parse_fold_block
         )
 
-        index = md.block.rules.index('block_quote')
-        if index != -1:
-            md.block.rules.insert(index, 'fold_block')
-        else:
-            md.block.rules.append('fold_block')
+        _insert_rule(md.block.rules, 'fold_block', before='block_quote')
 
         if md.renderer.NAME == "html":
             md.renderer.register("fold_block", self.render_html_fold_block)
 
 
 class mistunePluginMath:
-    MATH_BLOCK = re.compile(r'(\${2})((?:\\.|.)*)\${2}')
+    # (?:\\.|.)* would match the same lines, but backtracks exponentially
+    # over runs of backslashes when there is no closing $$
+    MATH_BLOCK = re.compile(r'(\${2})([^\n]*)\${2}')
     MATH_INLINE_PATTERN = (
         r'\$(?=[^\s\$])('
         r'(?:\\\$|[^\$])*'
@@ -558,11 +597,7 @@ class mistunePluginAlerts:
             'alert_block', self.ALERT_BLOCK, self.parse_alert_block
         )
 
-        index = md.block.rules.index('block_quote')
-        if index != -1:
-            md.block.rules.insert(index, 'alert_block')
-        else:
-            md.block.rules.append('alert_block')
+        _insert_rule(md.block.rules, 'alert_block', before='block_quote')
 
         if md.renderer.NAME == "html":
             md.renderer.register("alert_block", self.render_html_alert_block)
@@ -325,6 +325,15 @@ c=d
     assert "\\[a^2+b^2=c^2\\]" in html
 
 
+def test_math_block_dollar():
+    html, _ = render.markdown("Pythagoras\n\n$$a^2+b^2=c^2$$")
+    assert "\\[a^2+b^2=c^2\\]" in html
+    # an unclosed block must not backtrack over the backslashes forever
+    from otterwiki.renderer_plugins import mistunePluginMath
+
+    assert mistunePluginMath.MATH_BLOCK.match("$$" + "\\" * 64) is None
+
+
 def test_math_code_inline():
     text = "`$a$`"
     html, _ = render.markdown(text)
@@ -392,6 +401,32 @@ def test_footnote_multiref():
     assert '<a class="footnote" href="#fnref-27">aa</a>' in html
 
 
+def test_footnote_letter_from_index():
+    from otterwiki.renderer_plugins import plugin_footnotes
+
+    letter = plugin_footnotes._letter_from_index
+    assert letter(1) == "a"
+    assert letter(26) == "z"
+    assert letter(27) == "aa"
+    assert letter(28) == "ab"
+    assert letter(52) == "az"
+    assert letter(54) == "bb"
+    assert letter(702) == "zz"
+    assert letter(703) == "aaa"
+
+
+def test_insert_rule():
+    from otterwiki.renderer_plugins import _insert_rule
+
+    rules = ['a', 'b', 'c']
+    _insert_rule(rules, 'x', before='b')
+    assert rules == ['a', 'x', 'b', 'c']
+    _insert_rule(rules, 'y', after='c')
+    assert rules == ['a', 'x', 'b', 'c', 'y']
+    _insert_rule(rules, 'z', before='missing')
+    assert rules == ['a', 'x', 'b', 'c', 'y', 'z']
+
+
 def test_footnote_not_found():
     md = "Footnote[^1]"
     html, _ = render.markdown(md)
@@ -417,6 +452,48 @@ def test_tasklist():
     assert 3 == html.count("<li ") == html.count("</li>")
     assert 1 == html.count("checked")
 
+    # nested task lists
+    md = """- [ ] a
+  - [x] b
+    - [ ] c
+- d"""
+    html, _ = render.markdown(md)
+    assert 3 == html.count('<li class="task-list-item">')
+    assert 1 == html.count("checked")
+
+    # lists without any checkbox stay untouched
+    md = """- a
+- b"""
+    html, _ = render.markdown(md)
+    assert "task-list-item" not in html
+    assert 2 == html.count("<li>")
+
+
+def test_tasklist_hook_short_circuit():
+    from otterwiki.renderer_plugins import plugin_task_lists
+
+    def tokens():
+        return [
+            {
+                'type': 'list_item',
+                'children': [{'type': 'block_text', 'text': '[ ] a'}],
+                'params': (1,),
+            }
+        ]
+
+    # without checkboxes in the source the tokens are returned untouched
+    result = plugin_task_lists.task_lists_hook(
+        None, tokens(), {'_has_task_lists': False}
+    )
+    assert result == tokens()
+
+    # with checkboxes, or without the flag in the state, items are rewritten
+    for state in [{'_has_task_lists': True}, {}]:
+        result = plugin_task_lists.task_lists_hook(None, tokens(), state)
+        assert result[0]['type'] == 'task_list_item'
+        assert result[0]['params'] == (1, False)
+        assert result[0]['children'][0]['text'] == 'a'
+
 
 def test_fancy_blocks():
     md = """::: info
@@ -462,6 +539,13 @@ _unspecified alert_
     assert '<h4 class="alert-heading">Head of the block</h4>' in html
     assert '<em>unspecified alert</em>' in html
 
+    # regression: an unclosed block still reaches until the end of the
+    # document, as with the previous pattern
+    md = "::: info\n" + "a line of text\n" * 500
+    html, _ = render.markdown(md)
+    assert 'class="alert alert-primary' in html
+    assert html.count("a line of text") == 500
+
 
 def test_spoiler():
     md = """>! Spoiler blocks reveal their